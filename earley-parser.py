@@ -1,196 +1,483 @@
+from array import array
+from bisect import bisect_left, bisect_right
 from collections import deque, defaultdict
 from itertools import count
 from string import punctuation
 from tabulate import tabulate
 
+_STRIP = str.maketrans("", "", punctuation)  # removes punctuation from a sentence
+
 
 class Rule:
     """
     Represents a grammar rule in the form LHS -> RHS.
     The 'dot' indicates the current position in the RHS during parsing.
+    Symbols are stored as interned IDs; 'symbols' maps them back to names.
     """
 
-    def __init__(self, lhs, rhs, dot):
+    __slots__ = ("lhs", "rhs", "dot", "rhs_len", "next", "symbols", "advanced", "text")
+
+    def __init__(self, lhs, rhs, dot, symbols):
         self.lhs = lhs
         self.rhs = rhs
         self.dot = dot
+        self.rhs_len = len(rhs)
+        self.next = rhs[dot] if dot < self.rhs_len else -1  # symbol after the •
+        self.symbols = symbols
+        self.advanced = None  # the same rule with the • one symbol further
+        self.text = None  # formatted on first str() call
 
     def __str__(self):
-        before_dot = " ".join(self.rhs[: self.dot])
-        after_dot = " ".join(self.rhs[self.dot :])
-        return f"{self.lhs} -> {before_dot} • {after_dot}".replace("  ", " ").strip()
+        if self.text is None:
+            lhs = self.symbols[self.lhs]
+            names = [self.symbols[sym] for sym in self.rhs]
+            # the • goes between the matched and the remaining symbols
+            before_dot, after_dot = names[: self.dot], names[self.dot :]
+            self.text = " ".join([lhs, "->", *before_dot, "•", *after_dot])
+        return self.text
 
 
 class Edge:
-    """Represents a single entry in the Earley parsing chart."""
+    """
+    Represents a single entry in the Earley parsing chart.
+    Only the start of the span is stored: the end is the column
+    of the chart the edge belongs to.
+    """
+
+    __slots__ = ("id", "rule", "start", "complete", "links")
 
-    def __init__(self, id, rule, span, history):
+    def __init__(self, id, rule, start, link):
         self.id = id
         self.rule = rule
-        self.span: tuple[int, int] = span
-        self.history = history
+        self.start = start
+        self.complete = rule.dot == rule.rhs_len
+        """
+        One (parent, child, leo) link per derivation (packed: equal edges
+        are merged), where parent is this edge before the • was advanced and
+        child the complete edge it was advanced over. When the derivation
+        skipped a deterministic chain, leo is its LeoItem and child is the
+        complete edge at the bottom of the chain; otherwise leo is None.
+        Predicted and scanned edges have no links.
+        """
+        self.links = [link] if link else []
 
-    def to_dict(self):
+    def histories(self):
+        """
+        Rebuild the IDs of the complete edges the • was advanced over,
+        one list per derivation, by walking the parent links.
+        The complete edges a Leo chain skipped are not in the chart, so each
+        is written out in parentheses as its own history, e.g. "(5, (12, 21))".
+        """
+        if not self.links:
+            return [[]]
+        histories = []
+        for parent, child, leo in self.links:
+            children = [str(child.id)]
+            # rebuild the skipped edges from the bottom of the chain upwards
+            while leo and leo.above:
+                children = [
+                    "(" + ", ".join(history + [skipped]) + ")"
+                    for history in leo.edge.histories()
+                    for skipped in children
+                ]
+                leo = leo.above
+            histories += [
+                history + [skipped]
+                for history in parent.histories()
+                for skipped in children
+            ]
+        return histories
+
+    def to_dict(self, end):
         return {
             "ID": self.id,
             "RULE": str(self.rule),
-            "[start, end]": self.span,
-            "HIST": ", ".join((str(x) for x in self.history)),
+            "[start, end]": (self.start, end),
+            "HIST": " | ".join(
+                ", ".join(history) for history in self.histories()
+            ),
         }
 
 
+class LeoItem:
+    """
+    Memoizes a deterministic chain of completions (Leo's optimization).
+    'edge' is the only pending edge waiting for some symbol at some
+    position, and that symbol is the last one it needs. 'above' is the
+    LeoItem for the symbol 'edge' completes, if any, and 'top' is the
+    pending edge at the top of the chain.
+    """
+
+    __slots__ = ("edge", "above", "top")
+
+    def __init__(self, edge, above):
+        self.edge = edge
+        self.above = above
+        self.top = above.top if above else edge
+
+
 class EarleyParser:
     def __init__(self, syntax, lexicon, sentence):
-        self.syntax = defaultdict(
-            list, {k: [tuple(s.split()) for s in v] for k, v in syntax.items()}
-        )
-        self.lexicon = defaultdict(list, lexicon)
-        self.sentence = (
-            sentence.translate(str.maketrans("", "", punctuation)).lower().split()
+        """
+        Grammar symbols and words are interned to small int IDs.
+        Rules are built once per grammar rule and • position and shared
+        by all edges, so advancing the • never allocates a new Rule.
+        """
+        self.sym_id = {}  # symbol name -> ID
+        self.symbols = []  # symbol ID -> name
+        # non-terminal ID -> predicted rules B -> • γ
+        self.syntax = defaultdict(list)
+        for k, v in syntax.items():
+            for s in v:
+                rule = self._dotted_rules(k, s.split())[0]
+                # a production listed twice is one rule, or its edges
+                # would never be merged and each parse counted twice
+                if all(other.rhs != rule.rhs for other in self.syntax[rule.lhs]):
+                    self.syntax[rule.lhs].append(rule)
+        # category ID -> word ID -> scanned rule T -> word •
+        self.lexicon = defaultdict(dict)
+        for k, v in lexicon.items():
+            for w in v:
+                rule = self._dotted_rules(k, (w,))[-1]
+                self.lexicon[rule.lhs][rule.rhs[0]] = rule
+        # reuse S -> NP VP from the grammar when it has one, so the predicted
+        # S at position 0 is the start edge and not a second copy of it
+        start, start_rhs = self._intern("S"), (self._intern("NP"), self._intern("VP"))
+        start_rule = next(
+            (rule for rule in self.syntax.get(start, ()) if rule.rhs == start_rhs),
+            None,
         )
+        if start_rule is None:
+            start_rule = self._dotted_rules("S", ("NP", "VP"))[0]
+        self.parse_rule = start_rule
+        while self.parse_rule.advanced:
+            self.parse_rule = self.parse_rule.advanced  # S -> NP VP •
+        # the sentence as word IDs, -1 for words missing from the lexicon
+        words = sentence.translate(_STRIP).lower().split()
+        self.sentence_ids = array("i", (self.sym_id.get(w, -1) for w in words))
+        """
+        Give each category a bit and precompute, for every word in the
+        sentence, the mask of the categories it belongs to, so matching a
+        terminal against the input is a single AND
+        """
+        self.category_bit = {k: 1 << i for i, k in enumerate(self.lexicon)}
+        self.pos_cat_mask = [
+            sum(bit for k, bit in self.category_bit.items() if w in self.lexicon[k])
+            for w in self.sentence_ids
+        ]
+        self.first = self._first_categories()
         self.edge_id = count()  # next edge ID in table
         self.sentence_progress = 0  # how many words have been matched
-        self.chart = [Edge(next(self.edge_id), Rule("S", ("NP", "VP"), 0), (0, 0), [])]
+        self.chart = []
         """
-        We start each iteration (n + 1) of the algorithm from 
-        the start of the complete step of the iteration n 
-        (where edges which have matched n words) 
+        Edges are added to the chart one column at a time: we start
+        each iteration (n + 1) of the algorithm from the first edge
+        which has matched n words
         """
-        self.complete_start = 0  # start of complete step for the previous word
+        self.complete_start = 0  # start of the current column in the chart
         self.parse_count = 0  # how many successful parses
+        """
+        Per column: its [start, end) slice of the chart, and its incomplete
+        edges sorted by the next symbol after the •, alongside those symbols
+        so pending edges can be found by binary search
+        """
+        self.col_bounds = []
+        self.col_pending = []
+        self.col_next = []
+        # (rule, start) -> edge of the column being built, to merge equal edges
+        self.seen_items = {}
+        # (end, next symbol) -> LeoItem, or None if not deterministic
+        self.leo_items = {}
+        # (symbol, categories of the word) -> what predicting the symbol adds
+        self.prediction_cache = {}
+        self._add_edge(start_rule, 0, None)
+
+    def _intern(self, symbol):
+        """Map a grammar symbol or word to its int ID."""
+        if symbol not in self.sym_id:
+            self.sym_id[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return self.sym_id[symbol]
 
-    def predict(self):
+    def _dotted_rules(self, lhs, rhs):
         """
-        The predict step of the Earley algorithm.
-        For any edge A -> α • B β, where B is a non-terminal,
-        add new edges B -> • γ for all rules with B on the LHS.
-        These new edges start where the current edge ends.
+        Build the rule LHS -> RHS with the • at every position,
+        each linked to the next through Rule.advanced.
         """
-        # edges pending prediction (completed edges from last stage)
-        edge_queue = deque(self.chart[self.complete_start :])
-        seen = set()
+        lhs = self._intern(lhs)
+        rhs = tuple(self._intern(sym) for sym in rhs)
+        rules = [Rule(lhs, rhs, dot, self.symbols) for dot in range(len(rhs) + 1)]
+        for rule, advanced in zip(rules, rules[1:]):
+            rule.advanced = advanced
+        return rules
 
-        while edge_queue:
-            edge = edge_queue.popleft()
-            # do not add completed edges
-            if edge.rule.dot >= len(edge.rule.rhs):
-                continue
+    def _first_categories(self):
+        """
+        Compute the left-corner (FIRST) relation as category masks:
+        for each symbol, the categories that can start a string derived
+        from it. A category's mask is its own bit.
+        """
+        first = dict(self.category_bit)
+        changed = True
+        while changed:
+            changed = False
+            for lhs, rules in self.syntax.items():
+                mask = first.get(lhs, 0)
+                for rule in rules:
+                    # an empty rule has no next symbol (-1): it starts nothing
+                    mask |= first.get(rule.next, 0)
+                if mask != first.get(lhs, 0):
+                    first[lhs] = mask
+                    changed = True
+        return first
 
-            new_lhs = edge.rule.rhs[edge.rule.dot]
-
-            if new_lhs in self.syntax:
-                # if B is a non-terminal
-                for new_rhs in self.syntax[new_lhs]:
-                    if (new_lhs, new_rhs) not in seen:
-                        # create predicted edge: B -> • γ
-                        new_edge = Edge(
-                            next(self.edge_id),
-                            Rule(new_lhs, new_rhs, 0),
-                            (edge.span[1], edge.span[1]),
-                            [],
-                        )
-                        # add new_edge to predict_queue
-                        edge_queue.append(new_edge)
-                        self.chart.append(new_edge)
-                        seen.add((new_lhs, new_rhs))
-            else:
-                # if B is a terminal (pre-scan)
-                for new_word in self.lexicon[new_lhs]:
-                    # scan ahead to avoid creating unnecessary edges
-                    if new_word == self.sentence[self.sentence_progress]:
-                        if (new_lhs, new_word) not in seen:
-                            # create predicted edge B -> • new_word
-                            new_edge = Edge(
-                                next(self.edge_id),
-                                Rule(new_lhs, (new_word,), 0),
-                                (edge.span[1], edge.span[1]),
-                                [],
-                            )
-                            self.chart.append(new_edge)
-                            seen.add((new_lhs, new_word))
-
-    def scan(self):
+    def _add_edge(self, rule, start, link):
         """
-        The scan step of the Earley algorithm.
-        If an edge A -> α • T β is present, where T is a terminal (part-of-speech)
-        that matches the current word in the input sentence,
-        create a new edge A -> α T • β.
-        This advances the dot over the terminal and extends the span.
+        Append a new edge to the chart.
+        If an equal edge is already in the chart, the link
+        is merged into it instead and None is returned.
         """
-        scanned_edges = deque([])
-        for edge in self.chart[self.complete_start :]:
-            if edge.rule.lhs in self.lexicon:
-                """
-                move the • when you find a non-terminal in you lexicon.
-                we know from the predict step that its expansion must
-                match the sentence
-                """
-                edge.rule.dot += 1
-                edge.span = (edge.span[0], edge.span[1] + 1)
-                scanned_edges.append(edge)
+        key = (rule, start)
+        if key in self.seen_items:
+            if link:
+                self.seen_items[key].links.append(link)
+            return None
 
-        self.sentence_progress += 1
-        self.complete_start = len(self.chart)
-        return scanned_edges
+        edge = Edge(next(self.edge_id), rule, start, link)
+        self.seen_items[key] = edge
+        self.chart.append(edge)
+        return edge
 
-    def complete(self, completed_edges):
+    def _pending_edges(self, position, symbol):
         """
-        The complete step of the Earley algorithm.
-        If an edge B -> γ • is complete, find all pending edges A -> α • B β
-        where the complete edge's start matches the pending edge's end.
-        Create new edges A -> α B • β.
+        Return the incomplete edges ending at position whose next symbol
+        is symbol. Only called once the column at position is done.
         """
-        while completed_edges:
-            completed_edge = completed_edges.popleft()
-            for pending_edge in self.chart:
+        next_symbols = self.col_next[position]
+        lo = bisect_left(next_symbols, symbol)
+        hi = bisect_right(next_symbols, symbol, lo)
+        return self.col_pending[position][lo:hi]
+
+    def _leo_item(self, position, symbol):
+        """
+        Leo's optimization for right recursion. If exactly one pending edge
+        A -> α • B ends at position waiting for B (symbol), any B completed
+        there completes that edge, and in turn whatever is waiting for A.
+        Return the LeoItem for this chain, or None if it is not deterministic.
+        Only called once the column at position is done.
+        """
+        key = (position, symbol)
+        if key not in self.leo_items:
+            self.leo_items[key] = None  # guards against cycles of unit rules
+            # S completed at 0 may be the parse itself, so every such edge
+            # is added to the chart: no chain is allowed to skip it
+            if key == (0, self.parse_rule.lhs):
+                return None
+            pending = self._pending_edges(position, symbol)
+            edge = pending[0] if len(pending) == 1 else None
+            if edge and edge.rule.dot + 1 == edge.rule.rhs_len:
+                above = self._leo_item(edge.start, edge.rule.lhs)
+                self.leo_items[key] = LeoItem(edge, above)
+        return self.leo_items[key]
+
+    def _predictions(self, symbol, cat_mask):
+        """
+        Return what predicting symbol adds to a column whose word has the
+        categories cat_mask: the rules B -> • γ predicted from it, directly
+        or through other predicted rules, the mask of the symbols reached,
+        and the categories among them which match the word.
+        None of this depends on the position, so it is cached and reused
+        whenever a word with the same categories comes up again.
+        """
+        key = (symbol, cat_mask)
+        if key not in self.prediction_cache:
+            rules, reached, categories = [], 0, []
+            queue = deque([symbol])
+            while queue:
+                sym = queue.popleft()
+                if reached >> sym & 1:
+                    continue
+                reached |= 1 << sym
+
+                if sym not in self.syntax:
+                    if cat_mask & self.category_bit.get(sym, 0):
+                        categories.append(sym)
+                elif self.first.get(sym, 0) & cat_mask:
+                    for rule in self.syntax[sym]:
+                        # skip B -> • γ when γ cannot start with the word
+                        # (always for empty γ, whose next symbol is -1)
+                        if self.first.get(rule.next, 0) & cat_mask:
+                            rules.append(rule)
+                            queue.append(rule.next)
+            self.prediction_cache[key] = (rules, reached, categories)
+        return self.prediction_cache[key]
+
+    def count_derivations(self, edge):
+        """
+        Count the derivations (parse trees) of an edge.
+        Each link contributes the product of the counts of its parent and child,
+        and of the pending edges of the chain it skipped, if any.
+        Links can nest far deeper than the recursion limit, so edges and
+        LeoItems are counted in post-order off an explicit stack.
+        Raises ValueError if the links loop back to an edge being counted,
+        which cycles of unit rules can do: there are infinitely many parses.
+        """
+        memo = {}  # Edge or LeoItem -> count
+        expanding = set()  # nodes whose links are being counted
+        stack = [edge]
+        while stack:
+            node = stack[-1]
+            if node in memo:
+                stack.pop()
+                continue
+            if isinstance(node, LeoItem):
+                # a chain counts the pending edges it skipped, bar the top
+                below = (node.edge, node.above) if node.above else ()
+            else:
+                below = [n for link in node.links for n in link if n is not None]
+            missing = [n for n in below if n not in memo]
+            if missing:
+                # everything above an expanding node on the stack derives from it
+                if not expanding.isdisjoint(missing):
+                    raise ValueError("cycle of unit rules: infinitely many parses")
+                expanding.add(node)
+                stack.extend(missing)
+                continue
+            stack.pop()
+            expanding.discard(node)
+            if isinstance(node, LeoItem):
+                memo[node] = memo[node.edge] * memo[node.above] if node.above else 1
+            elif not node.links:
+                memo[node] = 1  # predicted and scanned edges
+            else:
+                memo[node] = sum(
+                    memo[parent] * memo[child] * (memo[leo] if leo else 1)
+                    for parent, child, leo in node.links
+                )
+        return memo[edge]
+
+    def process_column(self):
+        """
+        Runs the three steps of the Earley algorithm over the edges ending
+        at the current word in a single pass, using one worklist:
+        PREDICT: for an edge A -> α • B β, where B is a non-terminal,
+            add new edges B -> • γ for all rules with B on the LHS.
+        SCAN: for an edge A -> α • T β, where T is a terminal (part-of-speech)
+            that matches the current word, T -> word • is added to the next
+            column once this one is done.
+        COMPLETE: for an edge B -> γ •, find all pending edges A -> α • B β
+            where the complete edge's start matches the pending edge's end
+            and add new edges A -> α B • β.
+        """
+        # the worklist is the column itself: edges ending at this word start
+        # at complete_start (scanned at the end of the last column) and new
+        # edges are appended to the chart, so the loop picks them up
+        chart, i = self.chart, self.complete_start
+        seen = 0  # bitmask of symbols already predicted or scanned in this column
+        scanned = []  # categories matching the current word
+        position = self.sentence_progress
+        at_end = position == len(self.sentence_ids)
+        # bind hot lookups to locals once per column
+        add_edge, predictions = self._add_edge, self._predictions
+        pending_edges, leo_item = self._pending_edges, self._leo_item
+        cat_mask = 0 if at_end else self.pos_cat_mask[position]
+
+        while i < len(chart):
+            edge = chart[i]
+            i += 1
+
+            if edge.complete:
+                leo = leo_item(edge.start, edge.rule.lhs)
+                if leo:
+                    # complete a deterministic chain at once: only add its top
+                    add_edge(leo.top.rule.advanced, leo.top.start, (leo.top, edge, leo))
+                    continue
                 """
-                if pending_edge in incomplete and
-                pending_edge ends where completed_edge begins and
-                next non-terminal to process in pending_edge matches
-                LHS of completed_edge
+                complete: only visit pending edges which end where edge
+                begins and whose next symbol to process matches LHS of edge
                 """
-                if (
-                    pending_edge.rule.dot < len(pending_edge.rule.rhs)
-                    and pending_edge.span[1] == completed_edge.span[0]
-                    and pending_edge.rule.rhs[pending_edge.rule.dot]
-                    == completed_edge.rule.lhs
-                ):
+                for pending_edge in pending_edges(edge.start, edge.rule.lhs):
                     # construct new edge by merging a pending and complete edge
-                    new_edge = Edge(
-                        next(self.edge_id),
-                        Rule(
-                            pending_edge.rule.lhs,
-                            pending_edge.rule.rhs,
-                            pending_edge.rule.dot + 1,
-                        ),
-                        (pending_edge.span[0], completed_edge.span[1]),
-                        pending_edge.history + [completed_edge.id],
+                    add_edge(
+                        pending_edge.rule.advanced,
+                        pending_edge.start,
+                        (pending_edge, edge, None),
                     )
-                    self.chart.append(new_edge)
+                continue
 
-                    # check if we have completed parsing the whole the sentence
-                    if new_edge.rule.dot == len(new_edge.rule.rhs):
-                        if new_edge.rule.lhs == "S" and self.sentence_progress == len(
-                            self.sentence
-                        ):
-                            self.parse_count += 1
-                        else:
-                            completed_edges.append(new_edge)
+            new_lhs = edge.rule.next
+            # nothing is left to predict or scan after the last word
+            if at_end or seen >> new_lhs & 1:
+                continue
+            """
+            predict B and every non-terminal predicted from it at once:
+            the predicted edges' own next symbols are then already seen
+            """
+            rules, reached, categories = predictions(new_lhs, cat_mask)
+            for new_rule in rules:
+                # rules of symbols expanded earlier in this column are there
+                if not seen >> new_rule.lhs & 1:
+                    add_edge(new_rule, position, None)
+            # scan: terminals reached which match the current word
+            for category in categories:
+                if not seen >> category & 1:
+                    scanned.append(category)
+            seen |= reached
 
-    def run(self):
+        # sort the column's pending edges by next symbol (stable: keeps chart order)
+        pending = sorted(
+            (edge for edge in self.chart[self.complete_start :] if not edge.complete),
+            key=lambda edge: edge.rule.next,
+        )
+        self.col_bounds.append((self.complete_start, len(self.chart)))
+        self.col_pending.append(pending)
+        self.col_next.append([edge.rule.next for edge in pending])
+
+        self.complete_start = len(self.chart)
+        self.sentence_progress += 1
+        if not at_end:
+            # scanned edges start the next column
+            self.seen_items = {}
+            for category in scanned:
+                self.scan(category, position)
+
+    def scan(self, category, position):
+        """
+        The scan step of the Earley algorithm.
+        If an edge A -> α • T β is present, where T is a terminal (part-of-speech)
+        that matches the word at position in the input sentence,
+        create a new edge T -> word • spanning that word.
+        process_column() only calls this once it knows that T matches, so
+        T -> • word is never added to the chart.
+        """
+        rule = self.lexicon[category][self.sentence_ids[position]]
+        return self._add_edge(rule, position, None)
+
+    def parse(self):
         """
         Runs the Earley parsing algorithm through its main loop:
-        PREDICT -> SCAN -> COMPLETE for each word in the sentence.
-        Finally, prints the chart and the number of parses.
+        one PREDICT / SCAN / COMPLETE pass for each word in the sentence,
+        and a last COMPLETE pass after it.
+        Returns the number of parses.
         """
-        while self.sentence_progress < len(self.sentence):
-            self.predict()
-            scanned_edges = self.scan()
-            self.complete(scanned_edges)
+        while self.sentence_progress <= len(self.sentence_ids):
+            self.process_column()
 
+        # check if we have completed parsing the whole the sentence
+        parse_edge = self.seen_items.get((self.parse_rule, 0))
+        if parse_edge:
+            self.parse_count = self.count_derivations(parse_edge)
+        return self.parse_count
+
+    def print_chart(self):
+        """Prints the chart built by parse()."""
         print(
             tabulate(
-                [edge.to_dict() for edge in self.chart],
+                [
+                    edge.to_dict(end)
+                    for end, (start, stop) in enumerate(self.col_bounds)
+                    for edge in self.chart[start:stop]
+                ],
                 headers="keys",
                 tablefmt="plain",
                 stralign="left",
@@ -198,6 +485,10 @@ class EarleyParser:
             )
         )
 
+    def run(self):
+        """Parses the sentence, then prints the chart and the number of parses."""
+        self.parse()
+        self.print_chart()
         print(f"Parse Count: {self.parse_count}")
 
 
@@ -0,0 +1,175 @@
+import contextlib
+import importlib.util
+import io
+import random
+import unittest
+from functools import lru_cache
+from pathlib import Path
+
+# the script's file name is not a valid module name, so load it by path
+_spec = importlib.util.spec_from_file_location(
+    "earley_parser", Path(__file__).with_name("earley-parser.py")
+)
+earley_parser = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(earley_parser)
+
+SYNTAX = {
+    "S": ["NP VP"],
+    "NP": ["N PP", "N"],
+    "PP": ["P NP"],
+    "VP": ["VP PP", "V VP", "V NP", "V"],
+}
+LEXICON = {
+    "N": ["they", "can", "fish", "rivers", "december"],
+    "P": ["in"],
+    "V": ["can", "fish"],
+}
+
+
+def brute_force_count(syntax, lexicon, sentence):
+    """
+    Count the parses of sentence from S -> NP VP by trying every split of
+    every span. Assumes no cycles of unit rules; empty rules are ignored.
+    """
+    words = sentence.translate(earley_parser._STRIP).lower().split()
+    # duplicate productions are one rule, so they are counted once
+    rules = {k: {tuple(s.split()) for s in v if s.split()} for k, v in syntax.items()}
+
+    @lru_cache(maxsize=None)
+    def symbol(sym, i, j):
+        if sym not in rules:
+            return int(j == i + 1 and words[i] in lexicon.get(sym, ()))
+        return sum(sequence(rhs, i, j) for rhs in rules[sym])
+
+    @lru_cache(maxsize=None)
+    def sequence(rhs, i, j):
+        if len(rhs) == 1:
+            return symbol(rhs[0], i, j)
+        # every symbol covers at least one word
+        return sum(
+            symbol(rhs[0], i, k) * sequence(rhs[1:], k, j)
+            for k in range(i + 1, j - len(rhs) + 2)
+        )
+
+    return sequence(("NP", "VP"), 0, len(words)) if words else 0
+
+
+def chart_text(parser):
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf):
+        parser.print_chart()
+    return buf.getvalue()
+
+
+class ParseCountTest(unittest.TestCase):
+    def assertCount(self, syntax, lexicon, sentence):
+        parser = earley_parser.EarleyParser(syntax, lexicon, sentence)
+        expected = brute_force_count(syntax, lexicon, sentence)
+        self.assertEqual(parser.parse(), expected, sentence)
+        chart_text(parser)  # every history can be rebuilt
+        return parser
+
+    def test_example_sentences(self):
+        parser = earley_parser.EarleyParser(SYNTAX, LEXICON, "They can fish in rivers.")
+        self.assertEqual(parser.parse(), 4)
+        for sentence in [
+            "They can fish in rivers in December.",
+            "they can fish",
+            "fish in rivers can fish in december in rivers",
+            "in rivers",
+            "they swim",
+            "",
+        ]:
+            self.assertCount(SYNTAX, LEXICON, sentence)
+
+    def test_start_symbol_on_rhs(self):
+        syntax = {"S": ["NP VP"], "NP": ["N", "S"], "VP": ["V"]}
+        lexicon = {"N": ["they"], "V": ["can"]}
+        for sentence in ["they can", "they can can", "they can can can"]:
+            parser = self.assertCount(syntax, lexicon, sentence)
+            self.assertEqual(parser.parse_count, 1, sentence)
+
+    def test_duplicate_productions(self):
+        syntax = {"S": ["NP VP"], "NP": ["N", "N"], "VP": ["V"]}
+        lexicon = {"N": ["they"], "V": ["can"]}
+        parser = self.assertCount(syntax, lexicon, "they can")
+        self.assertEqual(parser.parse_count, 1)
+
+    def test_empty_rules(self):
+        # empty rules are accepted but never used
+        syntax = {
+            "S": ["NP VP"],
+            "NP": ["N", "D N"],
+            "D": ["", "A"],
+            "VP": ["V NP", "V"],
+        }
+        lexicon = {"N": ["they", "fish"], "A": ["the"], "V": ["can"]}
+        for sentence in ["they can", "can", "they can fish", "they can the fish"]:
+            self.assertCount(syntax, lexicon, sentence)
+
+    def test_right_recursion(self):
+        syntax = {"S": ["NP VP"], "NP": ["N"], "VP": ["V VP", "V"]}
+        lexicon = {"N": ["they"], "V": ["can", "fish"]}
+        parser = self.assertCount(syntax, lexicon, "they can can fish")
+        # the VPs skipped by the Leo chain are written out in the history
+        parse_line = chart_text(parser).splitlines()[-1]
+        self.assertIn("S -> NP VP •", parse_line)
+        self.assertTrue(parse_line.endswith("3, (7, (13, 21))"), parse_line)
+
+    def test_deep_derivation(self):
+        # each VP is the parent of the next: far deeper than the recursion limit
+        syntax = {"S": ["NP VP"], "NP": ["N"], "VP": ["VP V", "V"]}
+        lexicon = {"N": ["they"], "V": ["can"]}
+        parser = earley_parser.EarleyParser(syntax, lexicon, "they " + "can " * 3000)
+        self.assertEqual(parser.parse(), 1)
+
+    def test_unit_cycle(self):
+        syntax = {"S": ["NP VP"], "NP": ["N", "X"], "X": ["NP"], "VP": ["V"]}
+        lexicon = {"N": ["they"], "V": ["can"]}
+        parser = earley_parser.EarleyParser(syntax, lexicon, "they can")
+        with self.assertRaises(ValueError):
+            parser.parse()
+
+    def test_left_corner_pruning(self):
+        syntax = {"S": ["NP VP"], "NP": ["N", "D N"], "VP": ["V NP", "V"]}
+        lexicon = {"N": ["they", "fish"], "D": ["the"], "V": ["can"]}
+        parser = self.assertCount(syntax, lexicon, "they can fish")
+        # no word is a D, so NP -> D N is never predicted
+        self.assertNotIn("NP -> • D N", [str(edge.rule) for edge in parser.chart])
+
+    def test_prediction_cache(self):
+        syntax = {"S": ["NP VP"], "NP": ["N"], "VP": ["V VP", "V"]}
+        lexicon = {"N": ["they"], "V": ["can"]}
+        short = earley_parser.EarleyParser(syntax, lexicon, "they can can")
+        long = earley_parser.EarleyParser(syntax, lexicon, "they " + "can " * 20)
+        self.assertEqual(short.parse(), long.parse())
+        # every "can" has the same categories, so its predictions are reused
+        self.assertEqual(len(long.prediction_cache), len(short.prediction_cache))
+
+    def test_random_grammars(self):
+        rng = random.Random(0)
+        nts = ["S", "NP", "VP", "X", "Y"]
+        cats = ["A", "B", "C"]
+        words = ["a", "b", "c", "d"]
+        for _ in range(200):
+            syntax = {"S": ["NP VP"]}
+            for i, nt in enumerate(nts[1:], 1):
+                rules = set()
+                for _ in range(rng.randint(1, 4)):
+                    n = rng.randint(1, 3)
+                    # unit rules only point to later non-terminals (no unit
+                    # cycles), apart from S, which always derives NP VP
+                    if n == 1:
+                        rhs = [rng.choice(nts[i + 1 :] + cats + ["S"])]
+                    else:
+                        rhs = [rng.choice(nts + cats) for _ in range(n)]
+                    rules.add(" ".join(rhs))
+                syntax[nt] = sorted(rules)
+            lexicon = {c: rng.sample(words, rng.randint(1, 3)) for c in cats}
+            for _ in range(5):
+                sentence = " ".join(rng.choice(words) for _ in range(rng.randint(1, 6)))
+                self.assertCount(syntax, lexicon, sentence)
+
+
+if __name__ == "__main__":
+    unittest.main()